@@ -1,3 +1,9 @@
+import os
+
+# Vercel stops the function once the response is sent, so webhook events
+# must be processed within the request
+os.environ.setdefault("PROCESS_EVENTS_IN_BACKGROUND", "false")
+
 from app.main import app
 
 # This is the entry point for Vercel
@@ -3,10 +3,12 @@ Configuration Management Module
 Handles environment variables and application settings using Pydantic Settings
 """
 
-from functools import lru_cache
+import json
+import threading
+from functools import cached_property
 from typing import Literal
 
-from pydantic import Field, field_validator
+from pydantic import Field
 from pydantic_settings import BaseSettings
 
 
@@ -60,6 +62,8 @@ class Settings(BaseSettings):
     # Image Processing Configuration
     max_image_size_mb: float = Field(
         default=5.0,
+        gt=0,
+        le=20,
         description="Maximum allowed image size in MB"
     )
     image_max_dimension: int = Field(
@@ -68,6 +72,8 @@ class Settings(BaseSettings):
     )
     image_quality: int = Field(
         default=85,
+        ge=1,
+        le=100,
         description="JPEG/WebP compression quality (1-100)"
     )
 
@@ -77,6 +83,24 @@ class Settings(BaseSettings):
         description="User session state expiry time in hours"
     )
 
+    # Diagnosis Cache Configuration
+    diagnosis_cache_expiry_hours: int = Field(
+        default=24,
+        description="How long a diagnosis result is reused for the same image"
+    )
+    diagnosis_cache_max_entries: int = Field(
+        default=1000,
+        description="Maximum number of cached diagnosis results kept in memory"
+    )
+    last_result_max_entries: int = Field(
+        default=10000,
+        description="Maximum number of per-user last diagnosis results kept in memory"
+    )
+    last_result_expiry_hours: int = Field(
+        default=24,
+        description="How long a user's last diagnosis stays available for follow-up actions"
+    )
+
     # Rate Limiting Configuration
     max_requests_per_hour: int = Field(
         default=30,
@@ -93,39 +117,42 @@ class Settings(BaseSettings):
         description="Initial delay between retries in seconds"
     )
 
+    # Concurrency Configuration
+    io_threads: int = Field(
+        default=32,
+        ge=1,
+        description="Worker threads for blocking I/O (LINE push API, Gemini model listing)"
+    )
+    max_concurrent_diagnoses: int = Field(
+        default=16,
+        ge=1,
+        description="Maximum diagnoses running at once across all users"
+    )
+    process_events_in_background: bool = Field(
+        default=True,
+        description=(
+            "Acknowledge webhooks before processing events; disable on "
+            "serverless hosts that stop the process once the response is sent"
+        )
+    )
+
     # Sentry Configuration (Optional)
     sentry_dsn: str | None = Field(
         default=None,
         description="Sentry DSN for error tracking"
     )
 
-    @field_validator("max_image_size_mb")
-    @classmethod
-    def validate_image_size(cls, v: float) -> float:
-        """Validate image size is within reasonable limits."""
-        if v <= 0 or v > 20:
-            raise ValueError("max_image_size_mb must be between 0 and 20 MB")
-        return v
-
-    @field_validator("image_quality")
-    @classmethod
-    def validate_image_quality(cls, v: int) -> int:
-        """Validate image quality is within valid range."""
-        if v < 1 or v > 100:
-            raise ValueError("image_quality must be between 1 and 100")
-        return v
-
-    @property
+    @cached_property
     def max_image_size_bytes(self) -> int:
         """Get maximum image size in bytes."""
         return int(self.max_image_size_mb * 1024 * 1024)
 
-    @property
+    @cached_property
     def is_production(self) -> bool:
         """Check if running in production environment."""
         return self.environment == "prod"
 
-    @property
+    @cached_property
     def is_development(self) -> bool:
         """Check if running in development environment."""
         return self.environment == "dev"
@@ -138,15 +165,26 @@ class Settings(BaseSettings):
     }
 
 
-@lru_cache
+_settings: Settings | None = None
+_settings_lock = threading.Lock()
+
+
 def get_settings() -> Settings:
     """
     Get cached application settings.
 
+    The instance is built once per process; the lock guarantees concurrent
+    first callers do not each parse the environment.
+
     Returns:
         Settings: Application settings instance
     """
-    return Settings()
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = Settings()
+    return _settings
 
 
 # Gemini System Instruction for specialized rice disease diagnosis
@@ -204,3 +242,9 @@ DIAGNOSIS_JSON_SCHEMA = {
       "overall_confidence": "85%"
     }
 }
+
+# System instruction with the JSON schema substituted, rendered once at import
+GEMINI_SYSTEM_PROMPT = GEMINI_SYSTEM_INSTRUCTION.replace(
+    "{JSON_SCHEMA}",
+    json.dumps(DIAGNOSIS_JSON_SCHEMA, ensure_ascii=False, indent=2)
+)
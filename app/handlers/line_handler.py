@@ -3,18 +3,16 @@ LINE Webhook Handler Module
 Handles LINE webhook events and message routing
 """
 
+import asyncio
+import base64
+import hashlib
+import hmac
 import logging
-from typing import Any
+from typing import Any, Coroutine
 
-from linebot.v3 import WebhookHandler
+import httpx
+import orjson
 from linebot.v3.exceptions import InvalidSignatureError
-from linebot.v3.messaging import (
-    ApiClient,
-    Configuration,
-    MessagingApi,
-    ReplyMessageRequest,
-    TextMessage,
-)
 from linebot.v3.webhooks import (
     Event,
     FollowEvent,
@@ -31,11 +29,11 @@ from app.services.session_service import session_service
 from app.services.image_service import ImageValidationError, image_service
 from app.utils.text_messages import TextMessageBuilder
 from app.utils.parsers import (
-    is_greeting,
-    is_help_request,
-    is_skip_command,
+    INTENT_GREETING,
+    INTENT_HELP,
+    classify_intent,
+    get_postback_action,
     parse_plant_type,
-    parse_postback_data,
     parse_plant_part,
     sanitize_text,
 )
@@ -43,6 +41,33 @@ from app.utils.parsers import (
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+LINE_REPLY_URL = "https://api.line.me/v2/bot/message/reply"
+
+
+def _text_messages(*texts: str) -> list[dict[str, str]]:
+    """Build LINE text message objects in API JSON format."""
+    return [{"type": "text", "text": text} for text in texts]
+
+
+# Static replies, built once and reused for every matching event
+WELCOME_MESSAGES = _text_messages(TextMessageBuilder.format_welcome())
+SEND_IMAGE_MESSAGES = _text_messages("กรุณาส่งรูปภาพพืชที่ต้องการวินิจฉัยโรค 📷")
+RESEND_IMAGE_MESSAGES = _text_messages("กรุณาส่งรูปภาพใหม่อีกครั้ง 📷")
+RATE_LIMIT_MESSAGES = _text_messages(
+    TextMessageBuilder.format_error(
+        ERROR_MESSAGES["rate_limit_exceeded"].format(minutes=60)
+    )
+)
+API_ERROR_MESSAGES = _text_messages(
+    TextMessageBuilder.format_error(ERROR_MESSAGES["api_error"])
+)
+
+# Text replies by intent; anything else is prompted to send an image
+TEXT_INTENT_REPLIES = {
+    INTENT_GREETING: WELCOME_MESSAGES,
+    INTENT_HELP: WELCOME_MESSAGES,
+}
+
 
 class LineHandler:
     """
@@ -57,134 +82,159 @@ class LineHandler:
 
     def __init__(self):
         """Initialize LINE handler with SDK clients."""
-        self.webhook_handler = WebhookHandler(settings.line_channel_secret)
-        self.configuration = Configuration(
-            access_token=settings.line_channel_access_token
-        )
+        self._channel_secret = settings.line_channel_secret.encode("utf-8")
+        # Created lazily on the running loop; shared by all replies
+        self._http_client: httpx.AsyncClient | None = None
         self.message_handler = MessageHandler()
+        # Events and diagnoses run as background tasks so the webhook
+        # returns at once (unless disabled for serverless hosts);
+        # references are kept until they finish
+        self._diagnosis_semaphore = asyncio.Semaphore(
+            settings.max_concurrent_diagnoses
+        )
+        self._background_tasks: set[asyncio.Task] = set()
+        # Postback action name -> handler(user_id, reply_token)
+        self._postback_actions = {
+            "show_treatment": self._postback_show_treatment,
+            "show_diagnosis": self._postback_show_diagnosis,
+            "new_diagnosis": self._postback_new_diagnosis,
+            "retry": self._postback_retry,
+        }
+
+    async def handle_webhook(self, body: bytes, signature: str) -> None:
+        """
+        Handle incoming webhook request.
 
-        # Register event handlers
-        self._register_handlers()
-
-    def _register_handlers(self) -> None:
-        """Register event handlers with webhook handler."""
-
-        @self.webhook_handler.add(MessageEvent, message=TextMessageContent)
-        def handle_text_message(event: MessageEvent) -> None:
-            """Handle text message events."""
-            self._handle_text_message_sync(event)
+        Verifies the signature, then processes the events in a background
+        task so the webhook can be acknowledged at once. With
+        process_events_in_background disabled the events are processed
+        before returning instead.
 
-        @self.webhook_handler.add(MessageEvent, message=ImageMessageContent)
-        def handle_image_message(event: MessageEvent) -> None:
-            """Handle image message events."""
-            self._handle_image_message_sync(event)
+        Raises:
+            InvalidSignatureError: If the signature does not match the body
+        """
+        events = self.parse_events(body, signature)
+        if events:
+            await self._schedule(self.process_events(events))
 
-        @self.webhook_handler.add(PostbackEvent)
-        def handle_postback(event: PostbackEvent) -> None:
-            """Handle postback events."""
-            self._handle_postback_sync(event)
+    def parse_events(self, body: bytes, signature: str) -> list[Event]:
+        """
+        Verify the signature and parse webhook events from the raw body.
 
-        @self.webhook_handler.add(FollowEvent)
-        def handle_follow(event: FollowEvent) -> None:
-            """Handle follow events."""
-            self._handle_follow_sync(event)
+        Works on bytes end to end: the HMAC is computed over the body as
+        received and the JSON is parsed without decoding it to str first.
 
-    async def handle_webhook(self, body: str, signature: str) -> None:
+        Raises:
+            InvalidSignatureError: If the signature does not match the body
         """
-        Handle incoming webhook request.
-        Runs the synchronous handler in a separate thread to avoid event loop conflicts.
-        """
-        import asyncio
-        import functools
-
-        # Run the synchronous SDK handler in a thread
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(
-            None, 
-            functools.partial(self.webhook_handler.handle, body, signature)
+        expected = base64.b64encode(
+            hmac.new(self._channel_secret, body, hashlib.sha256).digest()
         )
+        if not hmac.compare_digest(signature.encode("utf-8"), expected):
+            raise InvalidSignatureError(f"Invalid signature. signature={signature}")
+
+        events = []
+        for event in orjson.loads(body)["events"]:
+            try:
+                events.append(Event.from_dict(event))
+            except ValueError:
+                logger.info(f"Unknown event type: {event.get('type')}")
+        return events
+
+    async def process_events(self, events: list[Event]) -> None:
+        """Dispatch each event to its async handler, logging failures."""
+        for event in events:
+            try:
+                await self._dispatch(event)
+            except Exception as e:
+                logger.error(f"Event processing failed: {e}", exc_info=True)
+
+    async def _schedule(self, coro: Coroutine[Any, Any, None]) -> None:
+        """Spawn the coroutine, or await it when background work is disabled."""
+        if settings.process_events_in_background:
+            self._spawn(coro)
+        else:
+            await coro
+
+    def _spawn(self, coro: Coroutine[Any, Any, None]) -> None:
+        """Run a coroutine as a background task tracked until it finishes."""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _dispatch(self, event: Event) -> None:
+        """Route a webhook event to its handler."""
+        if isinstance(event, MessageEvent):
+            if isinstance(event.message, TextMessageContent):
+                await self._handle_text_message(event)
+            elif isinstance(event.message, ImageMessageContent):
+                await self._handle_image_message(event)
+        elif isinstance(event, PostbackEvent):
+            await self._handle_postback(event)
+        elif isinstance(event, FollowEvent):
+            await self._handle_follow(event)
+
+    async def close(self) -> None:
+        """Wait for background work, then close the API clients."""
+        # Event tasks may spawn diagnosis tasks, so drain until empty
+        while self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+        self.message_handler.close()
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Get the shared async HTTP client, creating it on first use."""
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(
+                timeout=10.0,
+                headers={
+                    "Authorization": f"Bearer {settings.line_channel_access_token}"
+                }
+            )
+        return self._http_client
 
-    def _get_messaging_api(self) -> MessagingApi:
-        """Get MessagingApi client."""
-        api_client = ApiClient(self.configuration)
-        return MessagingApi(api_client)
-
-    def _reply_message(
-        self,
-        reply_token: str,
-        messages: list
-    ) -> None:
+    async def _post_reply(self, payload: dict[str, Any]) -> bool:
         """
-        Send reply message.
+        Post a reply payload to the LINE reply endpoint.
 
         Args:
-            reply_token: LINE reply token
-            messages: List of messages to send
+            payload: Reply request body in LINE API JSON format
+
+        Returns:
+            True if LINE accepted the reply
         """
         try:
-            api = self._get_messaging_api()
-            api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=reply_token,
-                    messages=messages
-                )
+            response = await self._get_http_client().post(
+                LINE_REPLY_URL,
+                json=payload
             )
+            response.raise_for_status()
+            return True
         except Exception as e:
             logger.error(f"Failed to send reply: {e}")
+            return False
 
-    def _reply_text(self, reply_token: str, text: str) -> None:
-        """Send a simple text reply."""
-        self._reply_message(reply_token, [TextMessage(text=text)])
-
-
-    # ==================== Synchronous Event Handlers ====================
+    async def _reply_text(self, reply_token: str, text: str) -> None:
+        """Send a simple text reply without building SDK models."""
+        await self._reply_texts(reply_token, [text])
 
-    def _handle_text_message_sync(self, event: MessageEvent) -> None:
-        """Handle text message event (sync wrapper)."""
-        import asyncio
-        import threading
-
-        # Create a new event loop for this thread if it doesn't exist
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-
-        loop.run_until_complete(self._handle_text_message(event))
-
-    def _handle_image_message_sync(self, event: MessageEvent) -> None:
-        """Handle image message event (sync wrapper)."""
-        import asyncio
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-
-        loop.run_until_complete(self._handle_image_message(event))
-
-    def _handle_postback_sync(self, event: PostbackEvent) -> None:
-        """Handle postback event (sync wrapper)."""
-        import asyncio
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+    async def _reply_texts(self, reply_token: str, texts: list[str]) -> bool:
+        """Send text replies in one request; returns True on success."""
+        return await self._reply_prebuilt(reply_token, _text_messages(*texts))
 
-        loop.run_until_complete(self._handle_postback(event))
-
-    def _handle_follow_sync(self, event: FollowEvent) -> None:
-        """Handle follow event (sync wrapper)."""
-        import asyncio
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+    async def _reply_prebuilt(
+        self,
+        reply_token: str,
+        messages: list[dict[str, str]]
+    ) -> bool:
+        """Send messages already in LINE API JSON format."""
+        return await self._post_reply({
+            "replyToken": reply_token,
+            "messages": messages
+        })
 
-        loop.run_until_complete(self._handle_follow(event))
 
     # ==================== Async Event Handlers ====================
 
@@ -201,19 +251,11 @@ class LineHandler:
 
         logger.info(f"Text message from {user_id}: {text[:50]}...")
 
-        # Check for greeting or help
-        if is_greeting(text) or is_help_request(text):
-            self._reply_text(
-                reply_token,
-                TextMessageBuilder.format_welcome()
-            )
-            return
-
-        # Default response - prompt to send image
-        self._reply_text(
-            reply_token,
-            "กรุณาส่งรูปภาพพืชที่ต้องการวินิจฉัยโรค 📷"
+        # Greeting or help gets the welcome; default prompts for an image
+        messages = TEXT_INTENT_REPLIES.get(
+            classify_intent(text), SEND_IMAGE_MESSAGES
         )
+        await self._reply_prebuilt(reply_token, messages)
 
     async def _handle_image_message(self, event: MessageEvent) -> None:
         """
@@ -234,12 +276,7 @@ class LineHandler:
                 user_id, max_requests=settings.max_requests_per_hour
             )
             if not is_allowed:
-                self._reply_text(
-                    reply_token,
-                    TextMessageBuilder.format_error(
-                        ERROR_MESSAGES["rate_limit_exceeded"].format(minutes=60)
-                    )
-                )
+                await self._reply_prebuilt(reply_token, RATE_LIMIT_MESSAGES)
                 return
 
             # Download and process image
@@ -248,15 +285,14 @@ class LineHandler:
                 settings.line_channel_access_token
             )
 
-            # Store image in session
+            # Store image in session with its content hash, computed once
+            # here and reused as the diagnosis cache key
+            image_hash = hashlib.blake2b(image_data, digest_size=16).digest()
             await session_service.set_user_image(
-                user_id, image_data, content_type
-            )
-
-            # Send info request message
-            self._reply_text(
-                reply_token,
-                TextMessageBuilder.format_processing()
+                user_id,
+                image_data,
+                content_type,
+                image_hash=image_hash
             )
 
             # Mark state as processing
@@ -264,22 +300,28 @@ class LineHandler:
                 user_id, UserState.PROCESSING
             )
 
-            # Trigger diagnosis immediately
-            await self.message_handler.process_diagnosis(user_id, self)
+            # Diagnose in the background; the result is sent with the
+            # reply token while it is still valid. The image is passed
+            # along so a later upload does not change what gets diagnosed
+            await self._start_diagnosis(
+                user_id,
+                reply_token,
+                event.timestamp,
+                image_data=image_data,
+                content_type=content_type,
+                image_hash=image_hash
+            )
 
         except ImageValidationError as e:
             logger.warning(f"Image validation failed: {e}")
-            self._reply_text(
+            await self._reply_text(
                 reply_token,
                 TextMessageBuilder.format_error(e.user_message)
             )
 
         except Exception as e:
             logger.error(f"Failed to process image: {e}")
-            self._reply_text(
-                reply_token,
-                TextMessageBuilder.format_error(ERROR_MESSAGES["api_error"])
-            )
+            await self._reply_prebuilt(reply_token, API_ERROR_MESSAGES)
 
     async def _handle_postback(self, event: PostbackEvent) -> None:
         """
@@ -289,37 +331,32 @@ class LineHandler:
             event: LINE postback event
         """
         user_id = event.source.user_id
-        data = parse_postback_data(event.postback.data)
+        action = get_postback_action(event.postback.data)
         reply_token = event.reply_token
 
-        logger.info(f"Postback from {user_id}: {data}")
+        logger.info(f"Postback from {user_id}: {action}")
 
-        # Postback handlers for plant type/part are deprecated in direct diagnosis flow.
-        # We keep the function structure for other postbacks like treatment or retry.
-        
-        # Handle show treatment
-        if data.get("show_treatment"):
-            await self.message_handler.show_treatment(user_id, reply_token, self)
+        handler = self._postback_actions.get(action)
+        if handler is not None:
+            await handler(user_id, reply_token)
 
-        # Handle show diagnosis
-        elif data.get("show_diagnosis"):
-            await self.message_handler.show_diagnosis(user_id, reply_token, self)
+    async def _postback_show_treatment(self, user_id: str, reply_token: str) -> None:
+        """Show treatment for the last diagnosis."""
+        await self.message_handler.show_treatment(user_id, reply_token, self)
 
-        # Handle new diagnosis
-        elif data.get("new_diagnosis"):
-            await session_service.clear_user_session(user_id)
-            self._reply_text(
-                reply_token,
-                "กรุณาส่งรูปภาพพืชที่ต้องการวินิจฉัยโรค 📷"
-            )
+    async def _postback_show_diagnosis(self, user_id: str, reply_token: str) -> None:
+        """Show the last diagnosis again."""
+        await self.message_handler.show_diagnosis(user_id, reply_token, self)
 
-        # Handle retry
-        elif data.get("retry"):
-            await session_service.clear_user_session(user_id)
-            self._reply_text(
-                reply_token,
-                "กรุณาส่งรูปภาพใหม่อีกครั้ง 📷"
-            )
+    async def _postback_new_diagnosis(self, user_id: str, reply_token: str) -> None:
+        """Start over and ask for a new image."""
+        await session_service.clear_user_session(user_id)
+        await self._reply_prebuilt(reply_token, SEND_IMAGE_MESSAGES)
+
+    async def _postback_retry(self, user_id: str, reply_token: str) -> None:
+        """Start over and ask for the image again."""
+        await session_service.clear_user_session(user_id)
+        await self._reply_prebuilt(reply_token, RESEND_IMAGE_MESSAGES)
 
     async def _handle_follow(self, event: FollowEvent) -> None:
         """
@@ -333,10 +370,7 @@ class LineHandler:
 
         logger.info(f"New follower: {user_id}")
 
-        self._reply_text(
-            reply_token,
-            TextMessageBuilder.format_welcome()
-        )
+        await self._reply_prebuilt(reply_token, WELCOME_MESSAGES)
 
     # ==================== Helper Methods ====================
 
@@ -348,7 +382,7 @@ class LineHandler:
     ) -> None:
         """Start the diagnosis process."""
         # Send processing message
-        self._reply_text(
+        await self._reply_text(
             reply_token,
             TextMessageBuilder.format_processing()
         )
@@ -357,7 +391,49 @@ class LineHandler:
         await session_service.set_user_state(user_id, UserState.PROCESSING)
 
         # Run diagnosis (this will send result via push message)
-        await self.message_handler.process_diagnosis(user_id, self)
+        await self._start_diagnosis(user_id)
+
+    async def _start_diagnosis(
+        self,
+        user_id: str,
+        reply_token: str | None = None,
+        event_timestamp: int | None = None,
+        image_data: bytes | None = None,
+        content_type: str | None = None,
+        image_hash: bytes | None = None
+    ) -> None:
+        """Schedule a diagnosis as a tracked background task."""
+        await self._schedule(
+            self._run_diagnosis(
+                user_id,
+                reply_token,
+                event_timestamp,
+                image_data,
+                content_type,
+                image_hash
+            )
+        )
+
+    async def _run_diagnosis(
+        self,
+        user_id: str,
+        reply_token: str | None,
+        event_timestamp: int | None,
+        image_data: bytes | None,
+        content_type: str | None,
+        image_hash: bytes | None
+    ) -> None:
+        """Run a diagnosis, limiting how many call Gemini at once."""
+        async with self._diagnosis_semaphore:
+            await self.message_handler.process_diagnosis(
+                user_id,
+                self,
+                reply_token=reply_token,
+                event_timestamp=event_timestamp,
+                image_data=image_data,
+                content_type=content_type,
+                image_hash=image_hash
+            )
 
 
 # Global line handler instance
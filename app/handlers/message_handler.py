@@ -3,7 +3,10 @@ Message Handler Module
 Handles message processing and diagnosis workflow
 """
 
+import asyncio
+import hashlib
 import logging
+import time
 from typing import TYPE_CHECKING
 
 from linebot.v3.messaging import (
@@ -15,7 +18,12 @@ from linebot.v3.messaging import (
 )
 
 from app.config import get_settings
-from app.models import DiagnosisResult, ERROR_MESSAGES, PlantType, UserState
+from app.models import (
+    ERROR_MESSAGES,
+    PlantType,
+    UserInfo,
+    UserState,
+)
 from app.services.session_service import session_service
 from app.services.gemini_service import GeminiAPIError, gemini_service
 from app.utils.text_messages import TextMessageBuilder
@@ -26,6 +34,19 @@ if TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# LINE accepts at most 5 messages per reply/push request
+MAX_MESSAGES_PER_REQUEST = 5
+
+# Reply tokens expire about a minute after the LINE event; leave some margin
+REPLY_TOKEN_TTL_SECONDS = 55
+
+
+def _diagnosis_cache_key(image_hash: bytes, user_info: UserInfo) -> bytes:
+    """Build the diagnosis cache key from the image hash and plant context."""
+    plant_type = user_info.plant_type.value if user_info.plant_type else ""
+    plant_part = user_info.plant_part.value if user_info.plant_part else ""
+    return image_hash + f"|{plant_type}|{plant_part}".encode()
+
 
 class MessageHandler:
     """
@@ -42,25 +63,33 @@ class MessageHandler:
         self.configuration = Configuration(
             access_token=settings.line_channel_access_token
         )
-        # Store last diagnosis result per user
-        self._last_results: dict[str, DiagnosisResult] = {}
+        # Built once so pushes reuse one HTTP connection pool
+        self._api_client = ApiClient(self.configuration)
+        self._messaging_api = MessagingApi(self._api_client)
+
+    def close(self) -> None:
+        """Release the LINE API client."""
+        self._api_client.close()
 
     def _get_messaging_api(self) -> MessagingApi:
-        """Get MessagingApi client."""
-        api_client = ApiClient(self.configuration)
-        return MessagingApi(api_client)
+        """Get the shared MessagingApi client."""
+        return self._messaging_api
 
-    def _push_message(self, user_id: str, messages: list) -> None:
+    async def _push_message(self, user_id: str, messages: list) -> None:
         """
         Send push message to user.
 
+        The SDK call is blocking, so it runs in the default executor to
+        keep the event loop free during the LINE API round trip.
+
         Args:
             user_id: LINE user ID
             messages: List of messages to send
         """
         try:
             api = self._get_messaging_api()
-            api.push_message(
+            await asyncio.to_thread(
+                api.push_message,
                 PushMessageRequest(
                     to=user_id,
                     messages=messages
@@ -69,14 +98,56 @@ class MessageHandler:
         except Exception as e:
             logger.error(f"Failed to send push message: {e}")
 
-    def _push_text(self, user_id: str, text: str) -> None:
-        """Send a simple text push message."""
-        self._push_message(user_id, [TextMessage(text=text)])
+    async def _push_texts(self, user_id: str, texts: list[str]) -> None:
+        """Send text messages to user in a single push request."""
+        await self._push_message(
+            user_id,
+            [TextMessage(text=text) for text in texts[:MAX_MESSAGES_PER_REQUEST]]
+        )
+
+    async def _send_texts(
+        self,
+        user_id: str,
+        texts: list[str],
+        line_handler: "LineHandler",
+        reply_token: str | None = None,
+        event_timestamp: int | None = None
+    ) -> None:
+        """
+        Send texts with the reply API if the token is still valid.
+
+        Falls back to the push API when there is no usable reply token or
+        LINE rejects the reply.
+
+        Args:
+            user_id: LINE user ID
+            texts: Texts to send
+            line_handler: LINE handler for sending replies
+            reply_token: Reply token of the triggering event
+            event_timestamp: LINE event time in milliseconds since the epoch
+        """
+        texts = texts[:MAX_MESSAGES_PER_REQUEST]
+
+        if (
+            reply_token
+            and event_timestamp is not None
+            and time.time() - event_timestamp / 1000 < REPLY_TOKEN_TTL_SECONDS
+        ):
+            if await line_handler._reply_texts(reply_token, texts):
+                return
+            logger.warning(f"Reply failed for user {user_id}, falling back to push")
+
+        await self._push_texts(user_id, texts)
 
     async def process_diagnosis(
         self,
         user_id: str,
-        line_handler: "LineHandler"
+        line_handler: "LineHandler",
+        reply_token: str | None = None,
+        event_timestamp: int | None = None,
+        image_data: bytes | None = None,
+        content_type: str | None = None,
+        image_hash: bytes | None = None
     ) -> None:
         """
         Process diagnosis for user.
@@ -84,66 +155,97 @@ class MessageHandler:
         Args:
             user_id: LINE user ID
             line_handler: LINE handler for sending messages
+            reply_token: Reply token to answer with, if still unused
+            event_timestamp: LINE event time in milliseconds since the epoch
+            image_data: Image captured when the diagnosis was scheduled;
+                read from the session if omitted
+            content_type: MIME type of image_data
+            image_hash: Content hash of image_data
         """
+        # Outgoing texts, sent together in one request at the end
+        messages: list[str] = []
+
         try:
-            # Get user data from session
-            image_data, content_type = await session_service.get_user_image(user_id)
+            # Get user data from session unless the caller captured the
+            # image, so a newer upload cannot replace it while queued
+            if image_data is None:
+                image_data, content_type = await session_service.get_user_image(user_id)
+                image_hash = await session_service.get_user_image_hash(user_id)
             user_info = await session_service.get_user_info(user_id)
 
             if not image_data:
-                self._push_text(
-                    user_id,
+                messages.append(
                     TextMessageBuilder.format_error(ERROR_MESSAGES["session_expired"])
                 )
                 await session_service.clear_user_session(user_id)
                 return
 
-            # Call Gemini for diagnosis
-            logger.info(f"Running Gemini diagnosis for user {user_id}")
-            result = await gemini_service.diagnose(
-                image_data=image_data,
-                plant_type=user_info.plant_type,
-                content_type=content_type or "image/jpeg",
-                plant_part=user_info.plant_part,
-                additional_info=user_info.additional_info
-            )
+            # Reuse the result if this exact image was diagnosed recently
+            if image_hash is None:
+                image_hash = hashlib.blake2b(image_data, digest_size=16).digest()
+            cache_key = _diagnosis_cache_key(image_hash, user_info)
+            result = await session_service.get_cached_diagnosis(cache_key)
 
-            # Store in memory for quick access during the session
-            self._last_results[user_id] = result
+            if result is not None:
+                logger.info(f"Using cached diagnosis for user {user_id}")
+            else:
+                # Only Gemini calls count towards the rate limit
+                is_allowed, _ = await session_service.check_and_increment(
+                    user_id, max_requests=settings.max_requests_per_hour
+                )
+                if not is_allowed:
+                    messages.append(
+                        TextMessageBuilder.format_error(
+                            ERROR_MESSAGES["rate_limit_exceeded"].format(minutes=60)
+                        )
+                    )
+                    await session_service.set_user_state(user_id, UserState.IDLE)
+                    return
+
+                # Call Gemini for diagnosis
+                logger.info(f"Running Gemini diagnosis for user {user_id}")
+                result = await gemini_service.diagnose(
+                    image_data=image_data,
+                    plant_type=user_info.plant_type,
+                    content_type=content_type or "image/jpeg",
+                    plant_part=user_info.plant_part,
+                    additional_info=user_info.additional_info
+                )
+                await session_service.cache_diagnosis(cache_key, result)
 
-            # Increment rate limit counter
-            await session_service.increment_rate_counter(user_id)
+            # Keep the result for the show treatment/diagnosis postbacks
+            await session_service.set_last_result(user_id, result)
 
             # Check confidence level
             if result.confidence_level < 50:
-                self._push_text(
-                    user_id,
+                messages.append(
                     TextMessageBuilder.format_error(ERROR_MESSAGES["low_confidence"])
                 )
             else:
                 # Send diagnosis and treatment as one text message
-                diagnosis_text = TextMessageBuilder.format_diagnosis_result(result)
-                self._push_text(user_id, diagnosis_text)
+                messages.append(TextMessageBuilder.format_diagnosis_result(result))
 
             # Update state
             await session_service.set_user_state(user_id, UserState.COMPLETED)
 
         except GeminiAPIError as e:
             logger.error(f"Gemini API error for user {user_id}: {e}")
-            self._push_text(
-                user_id,
-                TextMessageBuilder.format_error(e.user_message)
-            )
+            messages.append(TextMessageBuilder.format_error(e.user_message))
             await session_service.set_user_state(user_id, UserState.IDLE)
 
         except Exception as e:
             logger.error(f"Diagnosis failed for user {user_id}: {e}")
-            self._push_text(
-                user_id,
+            messages.append(
                 TextMessageBuilder.format_error(ERROR_MESSAGES["api_error"])
             )
             await session_service.set_user_state(user_id, UserState.IDLE)
 
+        finally:
+            if messages:
+                await self._send_texts(
+                    user_id, messages, line_handler, reply_token, event_timestamp
+                )
+
     async def show_treatment(
         self,
         user_id: str,
@@ -153,15 +255,15 @@ class MessageHandler:
         """
         Show treatment details for last diagnosis.
         """
-        result = self._last_results.get(user_id)
+        result = await session_service.get_last_result(user_id)
 
         if result:
-            line_handler._reply_text(
+            await line_handler._reply_text(
                 reply_token,
                 TextMessageBuilder.format_diagnosis_result(result)
             )
         else:
-            line_handler._reply_text(
+            await line_handler._reply_text(
                 reply_token,
                 "ไม่พบผลวินิจฉัย กรุณาส่งรูปภาพใหม่"
             )
@@ -175,22 +277,21 @@ class MessageHandler:
         """
         Show diagnosis result again.
         """
-        result = self._last_results.get(user_id)
+        result = await session_service.get_last_result(user_id)
 
         if result:
-            line_handler._reply_text(
+            await line_handler._reply_text(
                 reply_token,
                 TextMessageBuilder.format_diagnosis_result(result)
             )
         else:
-            line_handler._reply_text(
+            await line_handler._reply_text(
                 reply_token,
                 "ไม่พบผลวินิจฉัย กรุณาส่งรูปภาพใหม่"
             )
 
-    def clear_user_results(self, user_id: str) -> None:
+    async def clear_user_results(self, user_id: str) -> None:
         """
         Clear diagnosis results for user.
         """
-        if user_id in self._last_results:
-            del self._last_results[user_id]
+        await session_service.clear_last_result(user_id)
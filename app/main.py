@@ -3,23 +3,29 @@ FastAPI Main Application Module
 Plant Disease Detection LINE Chatbot
 """
 
+import asyncio
 import logging
+import os
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from datetime import datetime
+from datetime import datetime, timezone
+from importlib.util import find_spec
 
+import orjson
 from fastapi import FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from linebot.v3.exceptions import InvalidSignatureError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app import __version__
 from app.config import get_settings
 from app.handlers.line_handler import line_handler
 from app.models import ErrorResponse, HealthCheckResponse
 from app.services.session_service import session_service
-from app.services.gemini_service import gemini_service
 
 # Configure logging
 logging.basicConfig(
@@ -43,6 +49,17 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info(f"Starting Plant Disease Detection Chatbot v{__version__}")
     logger.info(f"Environment: {settings.environment}")
+    logger.info(
+        f"Event loop: {type(asyncio.get_running_loop()).__module__}"
+        f" ({type(asyncio.get_event_loop_policy()).__name__})"
+    )
+
+    # Size the executor behind asyncio.to_thread for blocking SDK calls
+    executor = ThreadPoolExecutor(
+        max_workers=settings.io_threads,
+        thread_name_prefix="io"
+    )
+    asyncio.get_running_loop().set_default_executor(executor)
 
     try:
         # Connect to In-memory Session store
@@ -58,9 +75,13 @@ async def lifespan(app: FastAPI):
     logger.info("Shutting down...")
 
     try:
+        await line_handler.close()
         await session_service.disconnect()
     except Exception as e:
         logger.error(f"Shutdown error: {e}")
+    finally:
+        # After line_handler.close(), so pending pushes have finished
+        executor.shutdown(wait=False)
 
 
 # Create FastAPI application
@@ -69,8 +90,10 @@ app = FastAPI(
     description="LINE Chatbot for diagnosing plant diseases using AI Vision",
     version=__version__,
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     docs_url="/docs" if settings.is_development else None,
     redoc_url="/redoc" if settings.is_development else None,
+    openapi_url="/openapi.json" if settings.is_development else None,
 )
 
 # Add CORS middleware
@@ -85,48 +108,86 @@ app.add_middleware(
 
 # ==================== Middleware ====================
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    """Log all incoming requests."""
-    start_time = time.time()
-
-    response = await call_next(request)
-
-    process_time = time.time() - start_time
-    logger.info(
-        f"{request.method} {request.url.path} - "
-        f"{response.status_code} - {process_time:.3f}s"
-    )
+# Requests slower than this are logged as warnings
+SLOW_REQUEST_SECONDS = 0.5
 
-    return response
 
+class ObservabilityMiddleware:
+    """
+    Tag each request with an ID and time it.
 
-@app.middleware("http")
-async def add_request_id(request: Request, call_next):
-    """Add request ID header for tracking."""
-    import uuid
+    Adds X-Request-ID and X-Response-Time headers and logs failed or
+    slow requests, all from one send wrapper.
+    """
 
-    request_id = str(uuid.uuid4())[:8]
-    request.state.request_id = request_id
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        request_id = os.urandom(4).hex()
+        scope.setdefault("state", {})["request_id"] = request_id
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                process_time = time.perf_counter() - start_time
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    (b"x-request-id", request_id.encode("latin-1")),
+                    (b"x-response-time", f"{process_time:.3f}s".encode("latin-1")),
+                ]
+
+                status_code = message["status"]
+                if status_code >= 500 or process_time > SLOW_REQUEST_SECONDS:
+                    level = logging.WARNING
+                elif status_code >= 400:
+                    level = logging.INFO
+                else:
+                    level = None
+                if level is not None:
+                    logger.log(
+                        level,
+                        f"{scope['method']} {scope['path']} - "
+                        f"{status_code} - {process_time:.3f}s"
+                    )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+# Pure ASGI middleware avoids BaseHTTPMiddleware's per-request task and
+# body buffering; the last one added runs outermost
+app.add_middleware(ObservabilityMiddleware)
+# Outermost, so compression is not counted in request timings; small
+# bodies such as the webhook acknowledgement are sent uncompressed
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
-    response = await call_next(request)
-    response.headers["X-Request-ID"] = request_id
 
-    return response
+# ==================== Exception Handlers ====================
 
+# Fixed production 500 payload, validated once at import
+PRODUCTION_ERROR_BODY = ErrorResponse(
+    error="internal_server_error",
+    message="An internal error occurred",
+    detail=None
+).model_dump()
 
-# ==================== Exception Handlers ====================
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     """Handle HTTP exceptions."""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
-        content=ErrorResponse(
-            error=exc.detail,
-            message=str(exc.detail),
-            detail=None
-        ).model_dump()
+        # Same shape as ErrorResponse, built without model validation
+        content={
+            "error": exc.detail,
+            "message": str(exc.detail),
+            "detail": None
+        }
     )
 
 
@@ -136,16 +197,12 @@ async def general_exception_handler(request: Request, exc: Exception):
     logger.error(f"Unhandled exception: {exc}", exc_info=True)
 
     if settings.is_production:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            content=ErrorResponse(
-                error="internal_server_error",
-                message="An internal error occurred",
-                detail=None
-            ).model_dump()
+            content=PRODUCTION_ERROR_BODY
         )
 
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content=ErrorResponse(
             error="internal_server_error",
@@ -157,34 +214,35 @@ async def general_exception_handler(request: Request, exc: Exception):
 
 # ==================== Endpoints ====================
 
+# Static root payload, serialized once
+ROOT_BODY = orjson.dumps({
+    "name": "Plant Disease Detection Chatbot",
+    "version": __version__,
+    "status": "running"
+})
+
+
 @app.get("/", include_in_schema=False)
 async def root():
     """Root endpoint."""
-    return {
-        "name": "Plant Disease Detection Chatbot",
-        "version": __version__,
-        "status": "running"
-    }
+    return Response(content=ROOT_BODY, media_type="application/json")
 
 
-@app.get("/health", response_model=HealthCheckResponse)
+# Schema documented via responses; no response_model validation per probe
+@app.get("/health", responses={200: {"model": HealthCheckResponse}})
 async def health_check():
     """
     Health check endpoint.
 
     Returns status of all services.
     """
-    services = {}
-
-    # Overall status
-    status_str = "healthy"
-
-    return HealthCheckResponse(
-        status=status_str,
-        version=__version__,
-        timestamp=datetime.utcnow(),
-        services=services
-    )
+    # Plain dict: serialized directly, no model instance per probe
+    return {
+        "status": "healthy",
+        "version": __version__,
+        "timestamp": datetime.now(timezone.utc),
+        "services": {}
+    }
 
 
 @app.api_route("/webhook", methods=["GET", "POST"])
@@ -199,7 +257,7 @@ async def webhook(request: Request):
         return {
             "status": "active",
             "message": "LINE Webhook endpoint is ready to receive POST requests.",
-            "timestamp": datetime.utcnow()
+            "timestamp": datetime.now(timezone.utc)
         }
 
     # Handle POST (LINE Webhook Events)
@@ -212,14 +270,14 @@ async def webhook(request: Request):
             detail="Missing X-Line-Signature header"
         )
 
-    # Get body
+    # Get body; kept as bytes for signature check and JSON parsing
     body = await request.body()
-    body_str = body.decode("utf-8")
 
-    logger.info(f"Webhook POST received: {len(body_str)} bytes")
+    logger.info(f"Webhook POST received: {len(body)} bytes")
 
     try:
-        await line_handler.handle_webhook(body_str, signature)
+        # Verifies the signature, then processes events in the background
+        await line_handler.handle_webhook(body, signature)
     except InvalidSignatureError:
         logger.warning("Invalid signature")
         raise HTTPException(
@@ -279,6 +337,15 @@ if settings.is_development:
 
 # ==================== Main Entry Point ====================
 
+def _available_cpus() -> int:
+    """Count the CPUs this process may run on, honouring affinity limits."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # sched_getaffinity is Linux-only
+        return os.cpu_count() or 1
+
+
 def main():
     """Run the application with Uvicorn."""
     import uvicorn
@@ -287,8 +354,17 @@ def main():
         "app.main:app",
         host="0.0.0.0",
         port=8000,
+        # uvloop is not installed on Windows; uvicorn picks asyncio there
+        loop="uvloop" if find_spec("uvloop") else "auto",
+        http="httptools" if find_spec("httptools") else "auto",
         reload=settings.is_development,
-        workers=1 if settings.is_development else 4,
+        # I/O-bound workload: 2 * cores + 1, as recommended for Gunicorn.
+        # Sessions, rate limits and caches live in process memory, so each
+        # worker keeps its own copy: a user's requests may land on
+        # different workers and the hourly limit is applied per worker
+        workers=1 if settings.is_development else _available_cpus() * 2 + 1,
+        # ObservabilityMiddleware already logs errors and slow requests
+        access_log=False,
         log_level=settings.log_level.lower()
     )
 
@@ -3,14 +3,15 @@ Pydantic Models Module
 Data validation and serialization models for the application
 """
 
-from datetime import datetime
-from enum import Enum
+import time
+from datetime import datetime, timezone
+from enum import StrEnum
 from typing import Any
 
 from pydantic import BaseModel, Field
 
 
-class PathogenType(str, Enum):
+class PathogenType(StrEnum):
     """Types of pathogens that can cause plant diseases."""
     FUNGUS = "เชื้อรา"
     VIRUS = "ไวรัส"
@@ -20,14 +21,14 @@ class PathogenType(str, Enum):
     UNKNOWN = "ไม่ทราบสาเหตุ"
 
 
-class Severity(str, Enum):
+class Severity(StrEnum):
     """Severity levels for plant diseases."""
     MILD = "เล็กน้อย"
     MODERATE = "ปานกลาง"
     SEVERE = "รุนแรง"
 
 
-class PlantType(str, Enum):
+class PlantType(StrEnum):
     """Supported plant types for diagnosis."""
     RICE = "ข้าว"
     CORN = "ข้าวโพด"
@@ -38,7 +39,7 @@ class PlantType(str, Enum):
     OTHER = "อื่นๆ"
 
 
-class PlantPart(str, Enum):
+class PlantPart(StrEnum):
     """Plant parts that can be affected by disease."""
     LEAF = "ใบ"
     STEM = "ลำต้น"
@@ -47,7 +48,7 @@ class PlantPart(str, Enum):
     OTHER = "อื่นๆ"
 
 
-class UserState(str, Enum):
+class UserState(StrEnum):
     """User conversation states."""
     IDLE = "idle"
     WAITING_FOR_IMAGE = "waiting_for_image"
@@ -62,6 +63,8 @@ class PrimaryIssue(BaseModel):
     class_en: str = Field(..., description="Class ที่ตรวจพบ (ภาษาอังกฤษ)")
     description: str = Field(..., description="คำอธิบายลักษณะอาการโดยสรุป (1–2 ประโยค)")
 
+    model_config = {"frozen": True}
+
 
 class VisualEvidence(BaseModel):
     """Structured visual evidence from image."""
@@ -70,6 +73,8 @@ class VisualEvidence(BaseModel):
     distribution: str = Field(..., description="การกระจายตัวของอาการบนใบ (กระจาย / รวมกลุ่ม / เฉพาะปลายใบ)")
     severity_observation: str = Field(..., description="ระดับความรุนแรงของอาการบนใบข้าว")
 
+    model_config = {"frozen": True}
+
 
 class DiseaseManagement(BaseModel):
     """Disease management recommendations."""
@@ -78,6 +83,8 @@ class DiseaseManagement(BaseModel):
     monitoring_and_prevention: list[str] = Field(..., description="การเฝ้าระวังและป้องกัน")
     chemical_management: list[str] = Field(..., description="การจัดการด้วยสารเคมี (หากจำเป็น)")
 
+    model_config = {"frozen": True}
+
 
 class DiagnosisSummary(BaseModel):
     """Diagnosis summary model."""
@@ -85,6 +92,8 @@ class DiagnosisSummary(BaseModel):
     severity: str = Field(..., description="ระดับความรุนแรง")
     overall_confidence: str = Field(..., description="ความมั่นใจโดยรวม")
 
+    model_config = {"frozen": True}
+
 
 class DiagnosisResult(BaseModel):
     """Complete diagnosis result from Gemini AI (Updated v2)."""
@@ -151,31 +160,19 @@ class UserSession(BaseModel):
         default=UserState.IDLE,
         description="Current conversation state"
     )
-    image_data: bytes | None = Field(
-        default=None,
-        description="Stored image data"
-    )
-    image_content_type: str | None = Field(
-        default=None,
-        description="Image MIME type"
-    )
     user_info: UserInfo = Field(
         default_factory=UserInfo,
         description="User provided information"
     )
-    created_at: datetime = Field(
-        default_factory=datetime.utcnow,
-        description="Session creation time"
+    created_at: int = Field(
+        default_factory=lambda: int(time.time()),
+        description="Session creation time (Unix epoch seconds)"
     )
-    updated_at: datetime = Field(
-        default_factory=datetime.utcnow,
-        description="Session last update time"
+    updated_at: int = Field(
+        default_factory=lambda: int(time.time()),
+        description="Session last update time (Unix epoch seconds)"
     )
 
-    model_config = {
-        "arbitrary_types_allowed": True
-    }
-
 
 class DiagnosisRequest(BaseModel):
     """Request model for diagnosis API."""
@@ -207,7 +204,7 @@ class HealthCheckResponse(BaseModel):
     status: str = Field(..., description="Service status")
     version: str = Field(..., description="Application version")
     timestamp: datetime = Field(
-        default_factory=datetime.utcnow,
+        default_factory=lambda: datetime.now(timezone.utc),
         description="Current timestamp"
     )
     services: dict[str, str] = Field(
@@ -4,22 +4,45 @@ Google Gemini Vision API integration for plant disease diagnosis
 """
 
 import asyncio
-import base64
-import json
 import logging
 import re
 from typing import Any
 
 import google.generativeai as genai
+import orjson
 from google.generativeai.types import HarmBlockThreshold, HarmCategory
 from google.api_core import exceptions as google_exceptions
+from pydantic import TypeAdapter, ValidationError
 
-from app.config import DIAGNOSIS_JSON_SCHEMA, GEMINI_SYSTEM_INSTRUCTION, get_settings
+from app.config import GEMINI_SYSTEM_PROMPT, get_settings
 from app.models import DiagnosisResult, ERROR_MESSAGES, PlantPart, PlantType
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# Built once; validates Gemini's JSON text in a single pass
+_DIAGNOSIS_ADAPTER = TypeAdapter(DiagnosisResult)
+
+# JSON wrapped in a markdown code block
+_JSON_BLOCK_RE = re.compile(r"```(?:json)?\s*([\s\S]*?)```")
+
+
+def _extract_json_text(response_text: str) -> str:
+    """
+    Strip a Gemini response down to its JSON text.
+
+    JSON mode usually returns a bare object, so the code-block search
+    only runs when the text does not already start with "{".
+    """
+    text = response_text.strip()
+    if text.startswith("{"):
+        return text
+
+    json_match = _JSON_BLOCK_RE.search(text)
+    if json_match:
+        text = json_match.group(1).strip()
+    return text
+
 
 class GeminiAPIError(Exception):
     """Exception raised when Gemini API fails."""
@@ -77,22 +100,21 @@ class GeminiService:
             "response_mime_type": "application/json",
         }
 
-        # Initialize model
-        self._model = None
-
-    def _get_model(self, model_name: str):
-        """Create a Gemini model instance for a specific model name."""
-        return genai.GenerativeModel(
-            model_name=model_name,
-            generation_config=self.generation_config,
-            safety_settings=self.safety_settings,
-            system_instruction=self._build_system_instruction()
-        )
-
-    def _build_system_instruction(self) -> str:
-        """Build the system instruction with JSON schema."""
-        schema_str = json.dumps(DIAGNOSIS_JSON_SCHEMA, ensure_ascii=False, indent=2)
-        return GEMINI_SYSTEM_INSTRUCTION.replace("{JSON_SCHEMA}", schema_str)
+        # Model instances by name, created on first use
+        self._models: dict[str, genai.GenerativeModel] = {}
+
+    def _get_model(self, model_name: str) -> genai.GenerativeModel:
+        """Get the Gemini model instance for a model name, creating it once."""
+        model = self._models.get(model_name)
+        if model is None:
+            model = genai.GenerativeModel(
+                model_name=model_name,
+                generation_config=self.generation_config,
+                safety_settings=self.safety_settings,
+                system_instruction=GEMINI_SYSTEM_PROMPT
+            )
+            self._models[model_name] = model
+        return model
 
     def _build_prompt(
         self,
@@ -147,10 +169,11 @@ class GeminiService:
         Returns:
             Image content dictionary
         """
-        base64_image = base64.b64encode(image_data).decode("utf-8")
+        # The SDK puts raw bytes straight into the Blob proto; a base64
+        # string would only be decoded back to the same bytes
         return {
             "mime_type": content_type,
-            "data": base64_image
+            "data": image_data
         }
 
     def _parse_response(self, response_text: str) -> DiagnosisResult:
@@ -166,23 +189,23 @@ class GeminiService:
         Raises:
             GeminiAPIError: If parsing fails
         """
-        # Clean up response text
-        text = response_text.strip()
-
-        # Try to extract JSON from markdown code blocks
-        json_match = re.search(r"```(?:json)?\s*([\s\S]*?)```", text)
-        if json_match:
-            text = json_match.group(1).strip()
+        text = _extract_json_text(response_text)
 
         try:
-            data = json.loads(text)
-            return DiagnosisResult.model_validate(data)
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {e}\nResponse: {text[:500]}")
+            return _DIAGNOSIS_ADAPTER.validate_json(text)
+        except ValidationError as e:
+            if any(error["type"] == "json_invalid" for error in e.errors()):
+                logger.error(f"JSON decode error: {e}\nResponse: {text[:500]}")
+                raise GeminiAPIError(
+                    f"Invalid JSON response: {e}",
+                    ERROR_MESSAGES["api_error"],
+                    retryable=True
+                )
+            logger.error(f"Validation error: {e}\nData: {text[:500]}")
             raise GeminiAPIError(
-                f"Invalid JSON response: {e}",
+                f"Response validation failed: {e}",
                 ERROR_MESSAGES["api_error"],
-                retryable=True
+                retryable=False
             )
         except Exception as e:
             logger.error(f"Validation error: {e}\nData: {text[:500]}")
@@ -230,12 +253,10 @@ class GeminiService:
                         f"using model: {model_name}"
                     )
 
-                    # Initialize model on demand
                     model = self._get_model(model_name)
 
-                    # Call Gemini API
-                    response = await asyncio.to_thread(
-                        model.generate_content,
+                    # Call Gemini API with the SDK's native async client
+                    response = await model.generate_content_async(
                         [prompt, image_content]
                     )
 
@@ -341,17 +362,12 @@ class GeminiService:
 
         try:
             model = self._get_model(self.fallback_models[0])
-            response = await asyncio.to_thread(
-                model.generate_content,
+            response = await model.generate_content_async(
                 [prompt, image_content]
             )
 
             if response.text:
-                text = response.text.strip()
-                json_match = re.search(r"```(?:json)?\s*([\s\S]*?)```", text)
-                if json_match:
-                    text = json_match.group(1).strip()
-                return json.loads(text)
+                return orjson.loads(_extract_json_text(response.text))
 
         except Exception as e:
             logger.warning(f"Image quality analysis failed: {e}")
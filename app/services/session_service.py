@@ -4,12 +4,16 @@ In-memory operations for session management
 """
 
 import logging
-from datetime import datetime, timedelta
+import time
 from typing import Any
 
-from app.models import UserInfo, UserState
+from app.config import get_settings
+from app.models import DiagnosisResult, UserInfo, UserState
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
+
+SECONDS_PER_HOUR = 3600
 
 
 class SessionService:
@@ -23,10 +27,15 @@ class SessionService:
     def __init__(self):
         """Initialize the in-memory session store."""
         # Simple dictionaries to store session data
-        self._user_states: dict[str, tuple[UserState, datetime]] = {}
-        self._user_images: dict[str, tuple[bytes, str, datetime]] = {}
-        self._user_info: dict[str, tuple[UserInfo, datetime]] = {}
-        self._rate_limits: dict[str, dict[str, int]] = {}
+        # Expiry values are time.monotonic() deadlines
+        self._user_states: dict[str, tuple[UserState, float]] = {}
+        self._user_images: dict[str, tuple[bytes, str, bytes | None, float]] = {}
+        self._user_info: dict[str, tuple[UserInfo, float]] = {}
+        # Per user: (hour bucket since epoch, requests in that hour)
+        self._rate_limits: dict[str, tuple[int, int]] = {}
+        self._diagnosis_cache: dict[bytes, tuple[DiagnosisResult, float]] = {}
+        self._diagnosis_cache_hits = 0
+        self._last_results: dict[str, tuple[DiagnosisResult, float]] = {}
 
     async def connect(self) -> None:
         """No-op for in-memory store."""
@@ -42,7 +51,7 @@ class SessionService:
         """Get user's current conversation state."""
         if user_id in self._user_states:
             state, expiry = self._user_states[user_id]
-            if datetime.utcnow() < expiry:
+            if time.monotonic() < expiry:
                 return state
             del self._user_states[user_id]
         return UserState.IDLE
@@ -55,37 +64,47 @@ class SessionService:
     ) -> None:
         """Set user's conversation state."""
         hours = expire_hours or 1
-        expiry = datetime.utcnow() + timedelta(hours=hours)
+        expiry = time.monotonic() + hours * SECONDS_PER_HOUR
         self._user_states[user_id] = (state, expiry)
         logger.debug(f"Set user state (memory): {user_id} -> {state.value}")
 
     async def get_user_image(self, user_id: str) -> tuple[bytes | None, str | None]:
         """Get stored user image data."""
         if user_id in self._user_images:
-            image_data, content_type, expiry = self._user_images[user_id]
-            if datetime.utcnow() < expiry:
+            image_data, content_type, _, expiry = self._user_images[user_id]
+            if time.monotonic() < expiry:
                 return image_data, content_type
             del self._user_images[user_id]
         return None, None
 
+    async def get_user_image_hash(self, user_id: str) -> bytes | None:
+        """Get the content hash stored with the user's image."""
+        if user_id in self._user_images:
+            _, _, image_hash, expiry = self._user_images[user_id]
+            if time.monotonic() < expiry:
+                return image_hash
+            del self._user_images[user_id]
+        return None
+
     async def set_user_image(
         self,
         user_id: str,
         image_data: bytes,
         content_type: str,
-        expire_hours: int | None = None
+        expire_hours: int | None = None,
+        image_hash: bytes | None = None
     ) -> None:
-        """Store user image data."""
+        """Store user image data and its content hash."""
         hours = expire_hours or 1
-        expiry = datetime.utcnow() + timedelta(hours=hours)
-        self._user_images[user_id] = (image_data, content_type, expiry)
+        expiry = time.monotonic() + hours * SECONDS_PER_HOUR
+        self._user_images[user_id] = (image_data, content_type, image_hash, expiry)
         logger.debug(f"Stored image in memory for user: {user_id}")
 
     async def get_user_info(self, user_id: str) -> UserInfo:
         """Get stored user information."""
         if user_id in self._user_info:
             info, expiry = self._user_info[user_id]
-            if datetime.utcnow() < expiry:
+            if time.monotonic() < expiry:
                 return info
             del self._user_info[user_id]
         return UserInfo()
@@ -98,7 +117,7 @@ class SessionService:
     ) -> None:
         """Store user information."""
         hours = expire_hours or 1
-        expiry = datetime.utcnow() + timedelta(hours=hours)
+        expiry = time.monotonic() + hours * SECONDS_PER_HOUR
         self._user_info[user_id] = (info, expiry)
         logger.debug(f"Stored user info in memory: {user_id}")
 
@@ -111,36 +130,109 @@ class SessionService:
 
     # ==================== Rate Limiting ====================
 
+    def _current_count(self, user_id: str, hour_key: int) -> int:
+        """Get the user's request count for the given hour bucket."""
+        bucket = self._rate_limits.get(user_id)
+        if bucket is None or bucket[0] != hour_key:
+            return 0
+        return bucket[1]
+
     async def check_rate_limit(
         self,
         user_id: str,
         max_requests: int = 10
     ) -> tuple[bool, int]:
         """Check if user has exceeded rate limit (in-memory)."""
-        hour_key = datetime.utcnow().strftime("%Y%m%d%H")
-        
-        if user_id not in self._rate_limits:
-            self._rate_limits[user_id] = {}
-        
-        counts = self._rate_limits[user_id]
-        current_count = counts.get(hour_key, 0)
-        
+        hour_key = int(time.time()) // SECONDS_PER_HOUR
+        current_count = self._current_count(user_id, hour_key)
+
         remaining = max_requests - current_count
         is_allowed = current_count < max_requests
-        
+
         return is_allowed, max(0, remaining)
 
-    async def increment_rate_counter(self, user_id: str) -> int:
-        """Increment rate limit counter (in-memory)."""
-        hour_key = datetime.utcnow().strftime("%Y%m%d%H")
-        
-        if user_id not in self._rate_limits:
-            self._rate_limits[user_id] = {}
-            
-        counts = self._rate_limits[user_id]
-        counts[hour_key] = counts.get(hour_key, 0) + 1
-        
-        return counts[hour_key]
+    async def check_and_increment(
+        self,
+        user_id: str,
+        max_requests: int = 10
+    ) -> tuple[bool, int]:
+        """
+        Check the rate limit and count the request in one step.
+
+        Nothing awaits between the check and the increment, so concurrent
+        diagnoses for the same user cannot both slip under the limit.
+
+        Returns:
+            Tuple of (is_allowed, remaining requests after this one)
+        """
+        hour_key = int(time.time()) // SECONDS_PER_HOUR
+        current_count = self._current_count(user_id, hour_key)
+
+        if current_count >= max_requests:
+            return False, 0
+
+        # Only the current hour is kept; a new hour replaces the old bucket
+        self._rate_limits[user_id] = (hour_key, current_count + 1)
+        return True, max_requests - current_count - 1
+
+    # ==================== Diagnosis Cache ====================
+
+    async def get_cached_diagnosis(self, image_hash: bytes) -> DiagnosisResult | None:
+        """Get a cached diagnosis result for an image hash."""
+        if image_hash in self._diagnosis_cache:
+            result, expiry = self._diagnosis_cache[image_hash]
+            if time.monotonic() < expiry:
+                self._diagnosis_cache_hits += 1
+                return result
+            del self._diagnosis_cache[image_hash]
+        return None
+
+    async def cache_diagnosis(
+        self,
+        image_hash: bytes,
+        result: DiagnosisResult,
+        expire_hours: int | None = None
+    ) -> None:
+        """Cache a diagnosis result, evicting the oldest entry when full."""
+        hours = expire_hours or settings.diagnosis_cache_expiry_hours
+        expiry = time.monotonic() + hours * SECONDS_PER_HOUR
+        self._diagnosis_cache.pop(image_hash, None)
+        if len(self._diagnosis_cache) >= settings.diagnosis_cache_max_entries:
+            oldest = next(iter(self._diagnosis_cache))
+            del self._diagnosis_cache[oldest]
+        self._diagnosis_cache[image_hash] = (result, expiry)
+        logger.debug(f"Cached diagnosis in memory: {image_hash.hex()}")
+
+    # ==================== Last Diagnosis Results ====================
+
+    async def get_last_result(self, user_id: str) -> DiagnosisResult | None:
+        """Get the user's most recent diagnosis result."""
+        if user_id in self._last_results:
+            result, expiry = self._last_results[user_id]
+            if time.monotonic() < expiry:
+                return result
+            del self._last_results[user_id]
+        return None
+
+    async def set_last_result(
+        self,
+        user_id: str,
+        result: DiagnosisResult,
+        expire_hours: int | None = None
+    ) -> None:
+        """Store the user's most recent diagnosis, evicting the least recently stored."""
+        hours = expire_hours or settings.last_result_expiry_hours
+        expiry = time.monotonic() + hours * SECONDS_PER_HOUR
+        self._last_results.pop(user_id, None)
+        if len(self._last_results) >= settings.last_result_max_entries:
+            oldest = next(iter(self._last_results))
+            del self._last_results[oldest]
+        self._last_results[user_id] = (result, expiry)
+        logger.debug(f"Stored last result in memory for user: {user_id}")
+
+    async def clear_last_result(self, user_id: str) -> None:
+        """Clear the user's most recent diagnosis result."""
+        self._last_results.pop(user_id, None)
 
     # ==================== Utility Methods ====================
 
@@ -150,6 +242,9 @@ class SessionService:
             "active_states": len(self._user_states),
             "active_images": len(self._user_images),
             "active_info": len(self._user_info),
+            "cached_diagnoses": len(self._diagnosis_cache),
+            "diagnosis_cache_hits": self._diagnosis_cache_hits,
+            "last_results": len(self._last_results),
         }
 
 
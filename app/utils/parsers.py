@@ -9,6 +9,80 @@ from urllib.parse import parse_qs
 
 from app.models import PlantPart, PlantType
 
+# Keyword tables for intent checks
+GREETING_KEYWORDS = (
+    "สวัสดี", "หวัดดี", "ดีครับ", "ดีค่ะ", "hello", "hi",
+    "hey", "สวัสดีครับ", "สวัสดีค่ะ", "ดี"
+)
+HELP_KEYWORDS = (
+    "ช่วย", "help", "วิธีใช้", "ใช้งาน", "ยังไง",
+    "อย่างไร", "คำสั่ง", "เมนู", "menu"
+)
+SKIP_KEYWORDS = ("ข้าม", "skip", "ไม่ระบุ", "ไม่ทราบ", "-")
+
+# Plant keyword tables, checked in order (Thai first, then English)
+_PLANT_TYPE_KEYWORDS = (
+    ("ข้าว", PlantType.RICE),
+    ("ข้าวโพด", PlantType.CORN),
+    ("ข้าวโพดเลี้ยงสัตว์", PlantType.CORN),
+    ("มันสำปะหลัง", PlantType.CASSAVA),
+    ("มัน", PlantType.CASSAVA),
+    ("อ้อย", PlantType.SUGARCANE),
+    ("พืชผัก", PlantType.VEGETABLE),
+    ("ผัก", PlantType.VEGETABLE),
+    ("ไม้ผล", PlantType.FRUIT),
+    ("ผลไม้", PlantType.FRUIT),
+    ("rice", PlantType.RICE),
+    ("corn", PlantType.CORN),
+    ("maize", PlantType.CORN),
+    ("cassava", PlantType.CASSAVA),
+    ("sugarcane", PlantType.SUGARCANE),
+    ("sugar cane", PlantType.SUGARCANE),
+    ("vegetable", PlantType.VEGETABLE),
+    ("fruit", PlantType.FRUIT),
+)
+_PLANT_PART_KEYWORDS = (
+    ("ใบ", PlantPart.LEAF),
+    ("ลำต้น", PlantPart.STEM),
+    ("ราก", PlantPart.ROOT),
+    ("กาบใบ", PlantPart.SHEATH),
+    ("กาบ", PlantPart.SHEATH),
+    ("leaf", PlantPart.LEAF),
+    ("stem", PlantPart.STEM),
+    ("root", PlantPart.ROOT),
+    ("sheath", PlantPart.SHEATH),
+)
+
+# Enum name lookups (lowercased) instead of scanning the enums
+_PLANT_TYPE_BY_NAME = {member.name.lower(): member for member in PlantType}
+_PLANT_PART_BY_NAME = {member.name.lower(): member for member in PlantPart}
+
+# Precompiled patterns (all linear-time, no nested quantifiers)
+_CONTROL_CHARS_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+_WHITESPACE_RE = re.compile(r"\s+")
+_NUMBER_RE = re.compile(r"\d+")
+
+# Intent tags returned by classify_intent
+INTENT_GREETING = "greeting"
+INTENT_HELP = "help"
+
+
+def _keyword_group(name: str, keywords: tuple[str, ...]) -> str:
+    """Build a named alternation group matching any of the keywords."""
+    return f"(?P<{name}>{'|'.join(re.escape(k) for k in keywords)})"
+
+
+# One pattern for all intents so text is scanned once. Skip keywords are
+# left out: they only matter as replies to a prompt, and "-" or "ไม่ทราบ"
+# would otherwise shadow help requests such as "- help"
+_INTENT_RE = re.compile(
+    "|".join((
+        _keyword_group(INTENT_GREETING, GREETING_KEYWORDS),
+        _keyword_group(INTENT_HELP, HELP_KEYWORDS),
+    )),
+    re.IGNORECASE
+)
+
 
 def parse_postback_data(data: str) -> dict[str, str]:
     """
@@ -31,6 +105,27 @@ def parse_postback_data(data: str) -> dict[str, str]:
     return result
 
 
+def get_postback_action(data: str) -> str | None:
+    """
+    Get the action name from postback data.
+
+    Accepts "action=show_treatment", the legacy "show_treatment=1" form,
+    or a bare "show_treatment".
+
+    Args:
+        data: Postback data string
+
+    Returns:
+        Action name or None if the data is empty
+    """
+    parsed = parse_postback_data(data)
+    if "action" in parsed:
+        return parsed["action"]
+    if parsed:
+        return next(iter(parsed))
+    return data.strip() or None
+
+
 def parse_plant_type(text: str) -> PlantType | None:
     """
     Parse plant type from user text input.
@@ -43,46 +138,12 @@ def parse_plant_type(text: str) -> PlantType | None:
     """
     text_lower = text.lower().strip()
 
-    # Direct Thai matches
-    thai_mappings = {
-        "ข้าว": PlantType.RICE,
-        "ข้าวโพด": PlantType.CORN,
-        "ข้าวโพดเลี้ยงสัตว์": PlantType.CORN,
-        "มันสำปะหลัง": PlantType.CASSAVA,
-        "มัน": PlantType.CASSAVA,
-        "อ้อย": PlantType.SUGARCANE,
-        "พืชผัก": PlantType.VEGETABLE,
-        "ผัก": PlantType.VEGETABLE,
-        "ไม้ผล": PlantType.FRUIT,
-        "ผลไม้": PlantType.FRUIT,
-    }
-
-    for key, plant_type in thai_mappings.items():
-        if key in text_lower:
-            return plant_type
-
-    # English matches
-    english_mappings = {
-        "rice": PlantType.RICE,
-        "corn": PlantType.CORN,
-        "maize": PlantType.CORN,
-        "cassava": PlantType.CASSAVA,
-        "sugarcane": PlantType.SUGARCANE,
-        "sugar cane": PlantType.SUGARCANE,
-        "vegetable": PlantType.VEGETABLE,
-        "fruit": PlantType.FRUIT,
-    }
-
-    for key, plant_type in english_mappings.items():
+    for key, plant_type in _PLANT_TYPE_KEYWORDS:
         if key in text_lower:
             return plant_type
 
     # Try matching enum names
-    for plant_type in PlantType:
-        if plant_type.name.lower() == text_lower:
-            return plant_type
-
-    return None
+    return _PLANT_TYPE_BY_NAME.get(text_lower)
 
 
 def parse_plant_part(text: str) -> PlantPart | None:
@@ -97,37 +158,12 @@ def parse_plant_part(text: str) -> PlantPart | None:
     """
     text_lower = text.lower().strip()
 
-    # Thai mappings
-    thai_mappings = {
-        "ใบ": PlantPart.LEAF,
-        "ลำต้น": PlantPart.STEM,
-        "ราก": PlantPart.ROOT,
-        "กาบใบ": PlantPart.SHEATH,
-        "กาบ": PlantPart.SHEATH,
-    }
-
-    for key, part in thai_mappings.items():
-        if key in text_lower:
-            return part
-
-    # English mappings
-    english_mappings = {
-        "leaf": PlantPart.LEAF,
-        "stem": PlantPart.STEM,
-        "root": PlantPart.ROOT,
-        "sheath": PlantPart.SHEATH,
-    }
-
-    for key, part in english_mappings.items():
+    for key, part in _PLANT_PART_KEYWORDS:
         if key in text_lower:
             return part
 
     # Try matching enum names
-    for part in PlantPart:
-        if part.name.lower() == text_lower:
-            return part
-
-    return None
+    return _PLANT_PART_BY_NAME.get(text_lower)
 
 
 def parse_user_response(text: str) -> dict[str, Any]:
@@ -171,6 +207,20 @@ def extract_plant_info(text: str) -> tuple[PlantType | None, PlantPart | None, s
     )
 
 
+def classify_intent(text: str) -> str | None:
+    """
+    Classify text into an intent tag in a single scan.
+
+    Args:
+        text: User input text
+
+    Returns:
+        INTENT_GREETING, INTENT_HELP or None if no keyword matches
+    """
+    match = _INTENT_RE.search(text)
+    return match.lastgroup if match else None
+
+
 def is_greeting(text: str) -> bool:
     """
     Check if text is a greeting.
@@ -181,12 +231,8 @@ def is_greeting(text: str) -> bool:
     Returns:
         True if text is a greeting
     """
-    greetings = [
-        "สวัสดี", "หวัดดี", "ดีครับ", "ดีค่ะ", "hello", "hi",
-        "hey", "สวัสดีครับ", "สวัสดีค่ะ", "ดี"
-    ]
     text_lower = text.lower().strip()
-    return any(greeting in text_lower for greeting in greetings)
+    return any(greeting in text_lower for greeting in GREETING_KEYWORDS)
 
 
 def is_help_request(text: str) -> bool:
@@ -199,12 +245,8 @@ def is_help_request(text: str) -> bool:
     Returns:
         True if text is asking for help
     """
-    help_keywords = [
-        "ช่วย", "help", "วิธีใช้", "ใช้งาน", "ยังไง",
-        "อย่างไร", "คำสั่ง", "เมนู", "menu"
-    ]
     text_lower = text.lower().strip()
-    return any(keyword in text_lower for keyword in help_keywords)
+    return any(keyword in text_lower for keyword in HELP_KEYWORDS)
 
 
 def is_skip_command(text: str) -> bool:
@@ -217,9 +259,8 @@ def is_skip_command(text: str) -> bool:
     Returns:
         True if user wants to skip
     """
-    skip_keywords = ["ข้าม", "skip", "ไม่ระบุ", "ไม่ทราบ", "-"]
     text_lower = text.lower().strip()
-    return any(keyword in text_lower for keyword in skip_keywords)
+    return any(keyword in text_lower for keyword in SKIP_KEYWORDS)
 
 
 def sanitize_text(text: str, max_length: int = 1000) -> str:
@@ -234,10 +275,10 @@ def sanitize_text(text: str, max_length: int = 1000) -> str:
         Sanitized text
     """
     # Remove control characters
-    text = re.sub(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]", "", text)
+    text = _CONTROL_CHARS_RE.sub("", text)
 
     # Normalize whitespace
-    text = re.sub(r"\s+", " ", text)
+    text = _WHITESPACE_RE.sub(" ", text)
 
     # Trim
     text = text.strip()
@@ -259,7 +300,7 @@ def extract_numbers(text: str) -> list[int]:
     Returns:
         List of extracted integers
     """
-    return [int(n) for n in re.findall(r"\d+", text)]
+    return [int(n) for n in _NUMBER_RE.findall(text)]
 
 
 def normalize_thai_text(text: str) -> str:
@@ -276,6 +317,6 @@ def normalize_thai_text(text: str) -> str:
     # (optional - depends on your use case)
 
     # Normalize spaces
-    text = re.sub(r"\s+", " ", text)
+    text = _WHITESPACE_RE.sub(" ", text)
 
     return text.strip()
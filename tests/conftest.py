@@ -111,3 +111,37 @@ def mock_line_webhook_body() -> str:
             }
         ]
     })
+
+
+@pytest.fixture
+def line_text_event() -> dict:
+    """A complete LINE text message event as sent by the platform."""
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": 1234567890000,
+        "webhookEventId": "test_event_id",
+        "deliveryContext": {"isRedelivery": False},
+        "source": {"type": "user", "userId": "test_user_id"},
+        "replyToken": "test_reply_token",
+        "message": {
+            "type": "text",
+            "id": "test_message_id",
+            "quoteToken": "test_quote_token",
+            "text": "สวัสดี"
+        }
+    }
+
+
+@pytest.fixture
+def sign_webhook_body():
+    """Return a function that signs a body with the test channel secret."""
+    import base64
+    import hashlib
+    import hmac
+
+    def sign(body: bytes) -> str:
+        digest = hmac.new(b"test_secret", body, hashlib.sha256).digest()
+        return base64.b64encode(digest).decode("utf-8")
+
+    return sign
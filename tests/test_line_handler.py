@@ -0,0 +1,89 @@
+"""
+Tests for LINE Handler
+"""
+
+import json
+
+import pytest
+from linebot.v3.exceptions import InvalidSignatureError
+from linebot.v3.webhooks import MessageEvent
+
+from app.handlers import line_handler as module
+from app.handlers.line_handler import LineHandler
+
+
+def _webhook_body(*events: dict) -> bytes:
+    """Build a raw webhook body containing the given events."""
+    return json.dumps(
+        {"destination": "test_destination", "events": list(events)}
+    ).encode("utf-8")
+
+
+class TestParseEvents:
+    """Test signature verification and event parsing."""
+
+    def test_signed_body_is_parsed(self, line_text_event, sign_webhook_body):
+        """Test a correctly signed body yields typed events."""
+        body = _webhook_body(line_text_event)
+
+        events = LineHandler().parse_events(body, sign_webhook_body(body))
+
+        assert len(events) == 1
+        assert isinstance(events[0], MessageEvent)
+        assert events[0].message.text == "สวัสดี"
+
+    def test_unknown_event_type_is_skipped(
+        self, line_text_event, sign_webhook_body
+    ):
+        """Test events of unknown types are dropped, not raised."""
+        unknown = {**line_text_event, "type": "brandNewEvent"}
+        body = _webhook_body(unknown, line_text_event)
+
+        events = LineHandler().parse_events(body, sign_webhook_body(body))
+
+        assert len(events) == 1
+        assert isinstance(events[0], MessageEvent)
+
+    def test_invalid_signature_raises(self, line_text_event, sign_webhook_body):
+        """Test a signature for a different body is rejected."""
+        body = _webhook_body(line_text_event)
+
+        with pytest.raises(InvalidSignatureError):
+            LineHandler().parse_events(body, sign_webhook_body(b"other"))
+
+
+class TestHandleWebhook:
+    """Test event dispatch from the webhook."""
+
+    @pytest.fixture
+    def line_handler(self, monkeypatch) -> LineHandler:
+        """Create a LINE handler that processes events in the request."""
+        monkeypatch.setattr(module.settings, "process_events_in_background", False)
+        handler = LineHandler()
+        handler.replies = []
+
+        async def post_reply(payload):
+            handler.replies.append(payload)
+            return True
+
+        monkeypatch.setattr(handler, "_post_reply", post_reply)
+        return handler
+
+    async def test_signed_body_dispatches_events(
+        self, line_handler, line_text_event, sign_webhook_body
+    ):
+        """Test each known event is dispatched and unknown ones skipped."""
+        unknown = {**line_text_event, "type": "brandNewEvent"}
+        body = _webhook_body(line_text_event, unknown)
+
+        await line_handler.handle_webhook(body, sign_webhook_body(body))
+
+        assert len(line_handler.replies) == 1
+        assert line_handler.replies[0]["replyToken"] == "test_reply_token"
+
+    async def test_malformed_body_raises(self, line_handler, sign_webhook_body):
+        """Test a signed body that is not JSON raises."""
+        body = b"not json"
+
+        with pytest.raises(ValueError):
+            await line_handler.handle_webhook(body, sign_webhook_body(body))
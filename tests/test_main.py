@@ -2,6 +2,8 @@
 Tests for FastAPI Main Application
 """
 
+import json
+
 import pytest
 from fastapi.testclient import TestClient
 
@@ -75,6 +77,42 @@ class TestWebhookEndpoint:
         )
         assert response.status_code == 400
 
+    def test_webhook_with_valid_signature(
+        self, client: TestClient, monkeypatch, line_text_event, sign_webhook_body
+    ):
+        """Test a correctly signed body is accepted and dispatched."""
+        from app.main import line_handler, settings
+
+        monkeypatch.setattr(settings, "process_events_in_background", False)
+        dispatched = []
+
+        async def dispatch(event):
+            dispatched.append(event)
+
+        monkeypatch.setattr(line_handler, "_dispatch", dispatch)
+        body = json.dumps({"events": [line_text_event]}).encode("utf-8")
+
+        response = client.post(
+            "/webhook",
+            content=body,
+            headers={"X-Line-Signature": sign_webhook_body(body)}
+        )
+
+        assert response.status_code == 200
+        assert len(dispatched) == 1
+
+    def test_webhook_with_malformed_body(
+        self, client: TestClient, sign_webhook_body
+    ):
+        """Test a correctly signed body that is not JSON returns 500."""
+        body = b"not json"
+        response = client.post(
+            "/webhook",
+            content=body,
+            headers={"X-Line-Signature": sign_webhook_body(body)}
+        )
+        assert response.status_code == 500
+
     def test_webhook_post_method_required(self, client: TestClient):
         """Test webhook only accepts POST method."""
         response = client.get("/webhook")
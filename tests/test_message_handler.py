@@ -0,0 +1,138 @@
+"""
+Tests for Message Handler
+"""
+
+import time
+
+import pytest
+
+from app.handlers import message_handler as module
+from app.handlers.line_handler import LineHandler
+from app.models import DiagnosisResult
+from app.services.session_service import SessionService
+
+
+class TestProcessDiagnosis:
+    """Test diagnosis delivery and caching."""
+
+    @pytest.fixture
+    def diagnosis_result(self) -> DiagnosisResult:
+        """Create a valid diagnosis result."""
+        example = DiagnosisResult.model_config["json_schema_extra"]["example"]
+        return DiagnosisResult.model_validate(example)
+
+    @pytest.fixture
+    def session_service(self, monkeypatch) -> SessionService:
+        """Use a fresh session store for each test."""
+        service = SessionService()
+        monkeypatch.setattr(module, "session_service", service)
+        return service
+
+    @pytest.fixture
+    def gemini_calls(self, monkeypatch, diagnosis_result) -> list:
+        """Stub Gemini and record each diagnose call."""
+        calls = []
+
+        async def diagnose(**kwargs):
+            calls.append(kwargs)
+            return diagnosis_result
+
+        monkeypatch.setattr(module.gemini_service, "diagnose", diagnose)
+        return calls
+
+    @pytest.fixture
+    def line_handler(self, monkeypatch):
+        """Create a LINE handler with stubbed reply and push calls."""
+        handler = LineHandler()
+        handler.replies = []
+        handler.pushes = []
+        handler.reply_ok = True
+
+        async def post_reply(payload):
+            handler.replies.append(payload)
+            return handler.reply_ok
+
+        async def push_message(user_id, messages):
+            handler.pushes.append((user_id, messages))
+
+        monkeypatch.setattr(handler, "_post_reply", post_reply)
+        monkeypatch.setattr(handler.message_handler, "_push_message", push_message)
+        return handler
+
+    async def _diagnose(self, line_handler, age_seconds: float = 0) -> None:
+        """Run a diagnosis for a LINE event that happened age_seconds ago."""
+        await line_handler.message_handler.process_diagnosis(
+            "U1",
+            line_handler,
+            reply_token="RT",
+            event_timestamp=int((time.time() - age_seconds) * 1000)
+        )
+
+    async def test_replies_with_valid_token(
+        self, session_service, gemini_calls, line_handler
+    ):
+        """Test the result uses the reply token while it is valid."""
+        await session_service.set_user_image("U1", b"img", "image/jpeg")
+
+        await self._diagnose(line_handler)
+
+        assert len(line_handler.replies) == 1
+        assert line_handler.replies[0]["replyToken"] == "RT"
+        assert line_handler.pushes == []
+
+    async def test_pushes_when_token_expired(
+        self, session_service, gemini_calls, line_handler
+    ):
+        """Test an expired reply token falls back to push."""
+        await session_service.set_user_image("U1", b"img", "image/jpeg")
+
+        await self._diagnose(line_handler, age_seconds=120)
+
+        assert line_handler.replies == []
+        assert len(line_handler.pushes) == 1
+        assert line_handler.pushes[0][0] == "U1"
+
+    async def test_pushes_when_reply_rejected(
+        self, session_service, gemini_calls, line_handler
+    ):
+        """Test a rejected reply falls back to push."""
+        await session_service.set_user_image("U1", b"img", "image/jpeg")
+        line_handler.reply_ok = False
+
+        await self._diagnose(line_handler)
+
+        assert len(line_handler.replies) == 1
+        assert len(line_handler.pushes) == 1
+
+    async def test_cache_hit_skips_gemini(
+        self, session_service, gemini_calls, line_handler
+    ):
+        """Test the same image is diagnosed by Gemini only once."""
+        await session_service.set_user_image(
+            "U1", b"img", "image/jpeg", image_hash=b"hash"
+        )
+
+        await self._diagnose(line_handler)
+        await self._diagnose(line_handler)
+
+        assert len(gemini_calls) == 1
+        assert len(line_handler.replies) == 2
+        stats = await session_service.get_stats()
+        assert stats["diagnosis_cache_hits"] == 1
+
+    async def test_uses_captured_image(
+        self, session_service, gemini_calls, line_handler
+    ):
+        """Test a queued diagnosis ignores a newer image in the session."""
+        await session_service.set_user_image("U1", b"newer", "image/png")
+
+        await line_handler.message_handler.process_diagnosis(
+            "U1",
+            line_handler,
+            image_data=b"queued",
+            content_type="image/jpeg",
+            image_hash=b"queued-hash"
+        )
+
+        assert gemini_calls[0]["image_data"] == b"queued"
+        assert gemini_calls[0]["content_type"] == "image/jpeg"
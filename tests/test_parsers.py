@@ -6,8 +6,12 @@ import pytest
 
 from app.models import PlantPart, PlantType
 from app.utils.parsers import (
+    INTENT_GREETING,
+    INTENT_HELP,
+    classify_intent,
     extract_numbers,
     extract_plant_info,
+    get_postback_action,
     is_greeting,
     is_help_request,
     is_skip_command,
@@ -44,6 +48,26 @@ class TestParsePostbackData:
         assert result == {"action": "show_treatment"}
 
 
+class TestGetPostbackAction:
+    """Test postback action extraction."""
+
+    def test_action_field(self):
+        """Test explicit action field."""
+        assert get_postback_action("action=retry&foo=bar") == "retry"
+
+    def test_legacy_key(self):
+        """Test key=value form uses the key as action."""
+        assert get_postback_action("show_treatment=1") == "show_treatment"
+
+    def test_bare_action(self):
+        """Test bare action string."""
+        assert get_postback_action("new_diagnosis") == "new_diagnosis"
+
+    def test_empty(self):
+        """Test empty data has no action."""
+        assert get_postback_action("") is None
+
+
 class TestParsePlantType:
     """Test plant type parsing."""
 
@@ -149,6 +173,34 @@ class TestIsSkipCommand:
         assert is_skip_command("-") is True
 
 
+class TestClassifyIntent:
+    """Test single-pass intent classification."""
+
+    def test_greeting(self):
+        """Test greetings are tagged."""
+        assert classify_intent("สวัสดีครับ") == INTENT_GREETING
+        assert classify_intent("Hello") == INTENT_GREETING
+
+    def test_help(self):
+        """Test help requests are tagged."""
+        assert classify_intent("วิธีใช้") == INTENT_HELP
+        assert classify_intent("HELP") == INTENT_HELP
+
+    def test_help_with_skip_keyword(self):
+        """Test skip keywords do not shadow a help request."""
+        assert classify_intent("ไม่ทราบว่าใช้งานยังไง") == INTENT_HELP
+        assert classify_intent("- help") == INTENT_HELP
+        assert classify_intent("ข้ามไปก่อน ช่วยด้วย") == INTENT_HELP
+
+    def test_skip_alone_has_no_intent(self):
+        """Test a bare skip command is not classified."""
+        assert classify_intent("ข้าม") is None
+
+    def test_no_intent(self):
+        """Test unmatched text returns None."""
+        assert classify_intent("ข้าวเป็นโรค") is None
+
+
 class TestSanitizeText:
     """Test text sanitization."""
 
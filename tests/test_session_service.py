@@ -0,0 +1,109 @@
+"""
+Tests for Session Service
+"""
+
+import pytest
+
+from app.models import DiagnosisResult, UserState
+from app.services.session_service import SessionService
+
+
+class TestSessionService:
+    """Test SessionService class."""
+
+    @pytest.fixture
+    def session_service(self):
+        """Create SessionService instance."""
+        return SessionService()
+
+    @pytest.fixture
+    def diagnosis_result(self) -> DiagnosisResult:
+        """Create a valid diagnosis result."""
+        example = DiagnosisResult.model_config["json_schema_extra"]["example"]
+        return DiagnosisResult.model_validate(example)
+
+    async def test_default_state_is_idle(self, session_service):
+        """Test unknown users start in the idle state."""
+        assert await session_service.get_user_state("U1") == UserState.IDLE
+
+    async def test_set_and_get_state(self, session_service):
+        """Test state round-trip."""
+        await session_service.set_user_state("U1", UserState.PROCESSING)
+        assert await session_service.get_user_state("U1") == UserState.PROCESSING
+
+    async def test_expired_state_falls_back_to_idle(self, session_service):
+        """Test expired state is dropped."""
+        session_service._user_states["U1"] = (UserState.PROCESSING, 0.0)
+        assert await session_service.get_user_state("U1") == UserState.IDLE
+        assert "U1" not in session_service._user_states
+
+    async def test_clear_user_session(self, session_service):
+        """Test clearing removes stored image."""
+        await session_service.set_user_image("U1", b"data", "image/jpeg")
+        await session_service.clear_user_session("U1")
+        assert await session_service.get_user_image("U1") == (None, None)
+
+    async def test_image_hash_stored_with_image(self, session_service):
+        """Test the image hash is kept alongside the image."""
+        await session_service.set_user_image(
+            "U1", b"data", "image/jpeg", image_hash=b"hash"
+        )
+        assert await session_service.get_user_image_hash("U1") == b"hash"
+        assert await session_service.get_user_image_hash("U2") is None
+
+    async def test_check_and_increment(self, session_service):
+        """Test the limiter counts requests and denies once exhausted."""
+        assert await session_service.check_and_increment("U1", 2) == (True, 1)
+        assert await session_service.check_and_increment("U1", 2) == (True, 0)
+        assert await session_service.check_and_increment("U1", 2) == (False, 0)
+        assert await session_service.check_rate_limit("U1", 2) == (False, 0)
+
+    async def test_rate_limit_resets_each_hour(self, session_service):
+        """Test counts from a previous hour are ignored."""
+        session_service._rate_limits["U1"] = (0, 5)
+        assert await session_service.check_rate_limit("U1", 5) == (True, 5)
+        assert await session_service.check_and_increment("U1", 5) == (True, 4)
+
+    async def test_cached_diagnosis_round_trip(
+        self, session_service, diagnosis_result
+    ):
+        """Test cached diagnosis is returned and counted as a hit."""
+        assert await session_service.get_cached_diagnosis(b"abc") is None
+
+        await session_service.cache_diagnosis(b"abc", diagnosis_result)
+
+        assert await session_service.get_cached_diagnosis(b"abc") == diagnosis_result
+        stats = await session_service.get_stats()
+        assert stats["cached_diagnoses"] == 1
+        assert stats["diagnosis_cache_hits"] == 1
+
+    async def test_cached_diagnosis_evicts_oldest(
+        self, session_service, diagnosis_result, monkeypatch
+    ):
+        """Test cache stays within its configured size."""
+        from app.services import session_service as module
+
+        monkeypatch.setattr(module.settings, "diagnosis_cache_max_entries", 2)
+
+        for key in (b"a", b"b", b"c"):
+            await session_service.cache_diagnosis(key, diagnosis_result)
+
+        assert await session_service.get_cached_diagnosis(b"a") is None
+        assert await session_service.get_cached_diagnosis(b"c") == diagnosis_result
+
+    async def test_last_result_evicts_oldest(
+        self, session_service, diagnosis_result, monkeypatch
+    ):
+        """Test per-user last results are bounded."""
+        from app.services import session_service as module
+
+        monkeypatch.setattr(module.settings, "last_result_max_entries", 2)
+
+        for user_id in ("U1", "U2", "U3"):
+            await session_service.set_last_result(user_id, diagnosis_result)
+
+        assert await session_service.get_last_result("U1") is None
+        assert await session_service.get_last_result("U3") == diagnosis_result
+
+        await session_service.clear_last_result("U3")
+        assert await session_service.get_last_result("U3") is None